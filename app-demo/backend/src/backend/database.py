@@ -1,10 +1,42 @@
+import os
 from typing import Annotated
 
 from fastapi import Depends
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
 
-engine = create_engine("postgresql://pguser:pgpassword@db:5432/postgres")
+DATABASE_URL = os.getenv(
+    "DATABASE_URL", "postgresql://pguser:pgpassword@db:5432/postgres"
+)
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+if DATABASE_URL.startswith("sqlite"):
+    # Sessions are used from FastAPI's thread pool, so connections must be
+    # shareable across threads.
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        pool_size=10,
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers proceed alongside the writer and, with
+        # synchronous=NORMAL, avoids an fsync on every commit.
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+else:
+    engine = create_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
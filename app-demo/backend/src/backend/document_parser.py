@@ -1,18 +1,120 @@
 import asyncio
-import base64
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from enum import Enum
+import hashlib
+import html
+import multiprocessing
 import os
-from typing import Dict, List, Literal
+import re
+from typing import Any, AsyncIterator, Dict, List, Literal
 
+from cachetools import TTLCache
+import httpx
 from openai import AsyncOpenAI
 
+import pybase64
 import pymupdf
+from PIL import features as pil_features
 from pydantic import BaseModel, Field
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+MODEL = "gpt-4.1-mini-2025-04-14"
+
+# Bump whenever a prompt or response schema changes so that cached LLM results
+# produced by the previous version are no longer hit.
+PROMPT_VERSION = "4"
+
+# System prompts are kept constant (and first) so every request shares the
+# same leading tokens, which lets OpenAI apply prompt caching.
+_PARSE_SYSTEM_PROMPT = """
+Parse the provided PDF pages and identify all document blocks. Each page is
+given as its underlying text and, unless it is text only, a full-page
+image, labelled "Page {n}". Return the blocks grouped by page_num, with one
+entry for every page.
+"""
+
+_EMBED_SYSTEM_PROMPT = """
+Create a detailed semantic description of this page content
+optimized for vector embedding and semantic search. Include key
+concepts, entities, relationships, and main ideas. Be
+comprehensive but focused.
+"""
+
+_PARSE_MESSAGES = ({"role": "system", "content": _PARSE_SYSTEM_PROMPT},)
+_EMBED_MESSAGES = ({"role": "system", "content": _EMBED_SYSTEM_PROMPT},)
+
+# Resolution pages are rasterized at for the vision model.
+RENDER_DPI = 120
+
+# Pages with no images or vector drawings and at least this much text are
+# sent to the model as text only.
+TEXT_ONLY_MIN_CHARS = 200
+
+# WebP is ~30% smaller than JPEG at similar quality; fall back to JPEG when
+# Pillow is built without it.
+IMAGE_FORMAT = "webp" if pil_features.check("webp") else "jpeg"
+
+# Maximum number of pages being rendered, or rendered but not yet consumed,
+# at any time. Enough to keep the render pool busy without holding the
+# images of the whole document in memory.
+RENDER_AHEAD = 8
+
+
+class PageCache:
+    """
+    In-memory cache of LLM results for page content.
+
+    Entries are keyed by a SHA-256 digest of the prompt version, model and
+    request content, so identical pages (repeated covers, boilerplate pages,
+    re-parsed documents) skip the OpenAI round-trip.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 24 * 60 * 60):
+        self._cache: TTLCache[str, Any] = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def key(kind: str, model: str, *parts: str) -> str:
+        digest = hashlib.sha256()
+        for part in (PROMPT_VERSION, kind, model, *parts):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Any | None:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self._cache[key] = value
+
+
+page_cache = PageCache()
+
+
+_openai_client: AsyncOpenAI | None = None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Lazily create the OpenAI client shared by all parsing requests, so its
+    connection pool (and TLS sessions) are reused across documents.
+    """
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=100, max_keepalive_connections=50
+                ),
+                timeout=httpx.Timeout(60.0, connect=5.0),
+            ),
+        )
+    return _openai_client
+
 
 class BlockType(str, Enum):
     """
@@ -115,13 +217,26 @@ class AIDocumentBlockSchema(BaseModel):
     )
 
 
-class AIDocumentParseResponseSchema(BaseModel):
+class AIDocumentPageSchema(BaseModel):
     """
-    Response from OpenAI for a single document block.
+    Blocks identified by OpenAI for a single page of a batch.
     """
 
+    page_num: int = Field(
+        description="Page number (1-indexed) the blocks belong to."
+    )
     blocks: List[AIDocumentBlockSchema] = Field(
-        description="List of document blocks"
+        description="List of document blocks on the page"
+    )
+
+
+class AIDocumentParseResponseSchema(BaseModel):
+    """
+    Response from OpenAI for a batch of document pages.
+    """
+
+    pages: List[AIDocumentPageSchema] = Field(
+        description="Document blocks grouped by page"
     )
 
 
@@ -157,9 +272,14 @@ class ParsedDocument(BaseModel):
     chunks: List[DocumentChunk] = Field(
         description="Organized collection of document chunks"
     )
+    missing_pages: List[int] = Field(
+        default_factory=list,
+        exclude=True,
+        description="Pages that could not be analyzed, e.g. after a failed request",
+    )
 
 
-async def load_pdf(bytes: bytes) -> ParsedDocument:
+async def load_pdf(bytes: bytes) -> pymupdf.Document:
     """
     Load a PDF document from bytes.
 
@@ -182,100 +302,246 @@ async def load_pdf(bytes: bytes) -> ParsedDocument:
         raise
 
 
-async def extract_page_data(
-    document: pymupdf.Document,
-) -> List[Dict[str, str]]:
+def _render_page(pdf_bytes: bytes, page_num: int) -> Dict[str, Any]:
     """
-    Extract text and images from each page of the document.
+    Extract text and, unless the page is text only, a rendered image from a
+    single page.
+
+    Runs inside a worker process, so the document is re-opened from bytes
+    (pymupdf.Document objects cannot be pickled across processes).
 
     Args:
-        document: A pymupdf.Document object
+        pdf_bytes: Raw binary data of the PDF document
+        page_num: Page index (0-indexed) to render
 
     Returns:
-        A list of dictionaries containing text and image for each page
+        A dictionary containing text and image for the page. `image_base64`
+        is None for text-only pages.
     """
-    logger.info(f"Extracting data from {len(document)} pages")
-    page_data = []
-
-    for page_num in range(len(document)):
-        logger.info(f"Processing page {page_num + 1}")
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as document:
         page = document[page_num]
 
-        # Extract text
-        text = page.get_text()
+        # Extract text from a single layout pass; the text page can be reused
+        # for any further extraction (e.g. "blocks") without redoing layout
+        textpage = page.get_textpage(flags=pymupdf.TEXTFLAGS_TEXT)
+        text = page.get_text("text", textpage=textpage)
+        del textpage
+
+        # Skip rasterizing pages that have nothing the text doesn't capture
+        text_only = (
+            len(text) > TEXT_ONLY_MIN_CHARS
+            and not page.get_images()
+            and not page.get_drawings()
+        )
 
-        # Extract image
-        pix = page.get_pixmap(alpha=False)
-        img_bytes = pix.tobytes("jpeg")
-        img_base64 = base64.b64encode(img_bytes).decode("utf-8")
+        img_base64 = None
+        if not text_only:
+            pix = page.get_pixmap(alpha=False, dpi=RENDER_DPI)
+            if IMAGE_FORMAT == "webp":
+                img_bytes = pix.pil_tobytes(format="WEBP", quality=80)
+            else:
+                img_bytes = pix.tobytes("jpeg")
+            img_base64 = pybase64.b64encode_as_string(img_bytes)
 
-        page_data.append(
-            {
-                "page_num": page_num + 1,  # 1-indexed
-                "text": text,
-                "image_base64": img_base64,
-            }
+    return {
+        "page_num": page_num + 1,  # 1-indexed
+        "text": text,
+        "image_base64": img_base64,
+    }
+
+
+_render_pool: ProcessPoolExecutor | None = None
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    """
+    Lazily create the process pool shared by all page rendering calls.
+
+    Workers are started with forkserver rather than fork, since forking the
+    multi-threaded server process can deadlock the child on a lock held by
+    another thread.
+    """
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(
+            max_workers=min(os.cpu_count() or 1, 4),
+            mp_context=multiprocessing.get_context("forkserver"),
         )
-        logger.info(
-            f"Extracted {len(text)} chars of text and image from page {page_num + 1}"
+    return _render_pool
+
+
+async def _render_page_in_pool(pdf_bytes: bytes, page_num: int) -> Dict[str, Any]:
+    """
+    Render a page on the shared process pool.
+
+    If a worker dies (e.g. killed by the OOM killer) the pool becomes
+    permanently broken, so it is discarded and the page is retried once on
+    a fresh pool.
+    """
+    global _render_pool
+    loop = asyncio.get_running_loop()
+    pool = _get_render_pool()
+    try:
+        return await loop.run_in_executor(pool, _render_page, pdf_bytes, page_num)
+    except BrokenProcessPool:
+        logger.warning("Render pool is broken, recreating it")
+        if _render_pool is pool:
+            _render_pool = None
+            pool.shutdown(wait=False)
+        return await loop.run_in_executor(
+            _get_render_pool(), _render_page, pdf_bytes, page_num
         )
 
-    logger.info(f"Completed extraction of {len(page_data)} pages")
-    return page_data
 
+async def extract_page_data(
+    pdf_bytes: bytes,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Extract text and images from each page of the document.
 
-async def analyze_page_with_openai(
-    client: AsyncOpenAI,
-    page_num: int,
-    page_text: str,
-    image_base64: str,
+    Pages are rendered in parallel on a process pool, since rasterizing and
+    encoding is CPU-bound, and yielded as soon as each one is done (not in
+    page order) so that analysis can start before the whole document is
+    rendered. At most RENDER_AHEAD pages are in flight, so rendering only
+    runs ahead of the consumer by that much.
+
+    Args:
+        pdf_bytes: Raw binary data of the PDF document
+
+    Yields:
+        A dictionary containing text and image for each page
+    """
+    document = await load_pdf(pdf_bytes)
+    page_count = len(document)
+    document.close()
+
+    logger.info(f"Extracting data from {page_count} pages")
+
+    pending = set()
+    next_page = 0
+    try:
+        while next_page < page_count or pending:
+            while next_page < page_count and len(pending) < RENDER_AHEAD:
+                pending.add(
+                    asyncio.ensure_future(
+                        _render_page_in_pool(pdf_bytes, next_page)
+                    )
+                )
+                next_page += 1
+
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                page = task.result()
+                logger.info(
+                    f"Extracted {len(page['text'])} chars of text"
+                    f"{' and image' if page['image_base64'] else ''} from page "
+                    f"{page['page_num']}"
+                )
+                yield page
+    finally:
+        for task in pending:
+            task.cancel()
+
+    logger.info(f"Completed extraction of {page_count} pages")
+
+
+def _page_cache_key(page: Dict[str, Any]) -> str:
+    image_digest = ""
+    if page["image_base64"]:
+        image_digest = hashlib.sha256(
+            page["image_base64"].encode("utf-8")
+        ).hexdigest()
+    return PageCache.key("parse", MODEL, page["text"], image_digest)
+
+
+def _to_document_blocks(
+    page_num: int, blocks_data: List[AIDocumentBlockSchema]
 ) -> List[DocumentBlock]:
+    page_blocks = []
+    for block_data in blocks_data:
+        # block_data was validated when the response was parsed
+        block = DocumentBlock.model_construct(
+            type=block_data.type,
+            page_num=page_num,
+            content=block_data.content,
+            semantic_content=block_data.semantic_content,
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Page %d block: type=%s len=%d",
+                page_num,
+                block.type,
+                len(block.content),
+            )
+        page_blocks.append(block)
+    logger.info("Page %d: %d blocks", page_num, len(page_blocks))
+    return page_blocks
+
+
+async def analyze_pages_with_openai(
+    client: AsyncOpenAI,
+    pages: List[Dict[str, Any]],
+) -> Dict[int, List[DocumentBlock]]:
     """
-    Analyze a single page with OpenAI asynchronously.
+    Analyze a batch of pages with a single OpenAI request asynchronously.
+
+    Pages whose results are already cached are not sent.
 
     Args:
         client: AsyncOpenAI client instance
-        page_num: Page number
-        page_text: Text content of the page
-        image_base64: Base64 encoded image data for the page
+        pages: List of dictionaries containing text and image for each page
 
     Returns:
-        List of DocumentBlock objects for the page
-    """
-
-    logger.info(f"Sending page {page_num} to OpenAI for analysis")
-
-    # Prepare the prompt
-    prompt = """
-    Parse the provided PDF page data (underlying text and full-page image) and
-    identify all document blocks.
-    """
-
-    messages = [
-        {"role": "system", "content": prompt},
-        {
-            "role": "user",
-            "content": f"Page {page_num} text: ```{page_text}```",
-        },
-        {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": f"Page {page_num} image:"},
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{image_base64}",
-                        "detail": "auto",
+        Mapping of page number to the DocumentBlock objects for that page
+    """
+    results: Dict[int, List[DocumentBlock]] = {}
+    misses = []
+    for page in pages:
+        blocks_data = page_cache.get(_page_cache_key(page))
+        if blocks_data is not None:
+            logger.info(f"Cache hit for page {page['page_num']}")
+            results[page["page_num"]] = _to_document_blocks(
+                page["page_num"], blocks_data
+            )
+        else:
+            misses.append(page)
+
+    if not misses:
+        return results
+
+    page_nums = [page["page_num"] for page in misses]
+    logger.info(f"Sending pages {page_nums} to OpenAI for analysis")
+
+    content = []
+    for page in misses:
+        content.append(
+            {
+                "type": "text",
+                "text": f"Page {page['page_num']} text: ```{page['text']}```",
+            }
+        )
+        if page["image_base64"]:
+            content.extend(
+                [
+                    {"type": "text", "text": f"Page {page['page_num']} image:"},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/{IMAGE_FORMAT};base64,"
+                            f"{page['image_base64']}",
+                            "detail": "auto",
+                        },
                     },
-                },
-            ],
-        },
-    ]
+                ]
+            )
+
+    messages = [*_PARSE_MESSAGES, {"role": "user", "content": content}]
 
-    page_blocks = []
     try:
         response = await client.beta.chat.completions.parse(
-            model="gpt-4.1-mini-2025-04-14",
+            model=MODEL,
             messages=messages,
             response_format=AIDocumentParseResponseSchema,
         )
@@ -284,74 +550,148 @@ async def analyze_page_with_openai(
 
         if response_message.refusal:
             logger.error(
-                f"OpenAI refused to parse page {page_num}: "
+                f"OpenAI refused to parse pages {page_nums}: "
                 f"{response_message.refusal}"
             )
-            return []
+            return results
 
-        blocks_data = response_message.parsed.blocks
+        parsed_pages = {
+            parsed_page.page_num: parsed_page.blocks
+            for parsed_page in response_message.parsed.pages
+        }
 
-        logger.info(f"Received {len(blocks_data)} blocks for page {page_num}")
+        for page in misses:
+            page_num = page["page_num"]
+            blocks_data = parsed_pages.get(page_num)
+            if blocks_data is None:
+                logger.error(f"OpenAI returned no blocks for page {page_num}")
+                continue
 
-        for block_data in blocks_data:
-            block = DocumentBlock(
-                type=block_data.type,
-                page_num=page_num,
-                content=block_data.content,
-                semantic_content=block_data.semantic_content,
-            )
-            logger.info(f"Page {page_num}; Block:\n{block}")
-            page_blocks.append(block)
+            page_cache.set(_page_cache_key(page), blocks_data)
+            results[page_num] = _to_document_blocks(page_num, blocks_data)
 
     except Exception as e:
-        logger.error(f"Error analyzing page {page_num}: {str(e)}")
+        logger.error(f"Error analyzing pages {page_nums}: {str(e)}")
 
-    return page_blocks
+    return results
 
 
 async def analyze_with_openai(
-    page_data: List[Dict[str, str]],
-    max_concurrency: int = 10,
-) -> List[DocumentBlock]:
+    page_data: AsyncIterator[Dict[str, Any]],
+    client: AsyncOpenAI,
+    batch_size: int = 10,
+    max_concurrency: int = 4,
+) -> tuple[List[List[DocumentBlock]], List[int]]:
     """
     Use OpenAI's model to analyze the document and identify blocks.
 
+    Pages are sent in batches of `batch_size` per request, which amortizes
+    the per-request overhead and system prompt over several pages. A batch is
+    dispatched as soon as it fills up, so requests overlap with the rendering
+    of later pages. No more pages are taken from `page_data` while
+    `max_concurrency` batches are in flight, which bounds how many rendered
+    pages are held in memory.
+
     Args:
-        page_data: List of dictionaries containing text and images for each page
+        page_data: Async iterator of dictionaries containing text and images
+            for each page
+        client: AsyncOpenAI client instance
+        batch_size: Number of pages per OpenAI request
+        max_concurrency: Maximum number of in-flight requests
 
     Returns:
-        List of DocumentBlock objects
+        DocumentBlock objects grouped by page, in page order, with pages
+        without any blocks omitted; and the numbers of the pages OpenAI
+        returned no result for (failed or refused requests, pages left out
+        of the response).
     """
-    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    # Limit the number of batches in flight
+    semaphore = asyncio.Semaphore(max_concurrency)
 
-    all_blocks = []
+    async def process_batch(batch):
+        try:
+            return await analyze_pages_with_openai(client=client, pages=batch)
+        finally:
+            semaphore.release()
+
+    async def dispatch(batch):
+        # Wait for a free slot before pulling more pages
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(process_batch(batch)))
+
+    tasks = []
+    batch = []
+    page_nums = []
+    async for page in page_data:
+        page_nums.append(page["page_num"])
+        batch.append(page)
+        if len(batch) == batch_size:
+            await dispatch(batch)
+            batch = []
+    if batch:
+        await dispatch(batch)
+
+    # Collect results as batches finish
+    page_blocks: Dict[int, List[DocumentBlock]] = {}
+    for task in asyncio.as_completed(tasks):
+        page_blocks.update(await task)
+
+    # Order pages, dropping those without blocks
+    pages = [
+        page_blocks[page_num]
+        for page_num in sorted(page_blocks)
+        if page_blocks[page_num]
+    ]
 
-    # Process pages in batches to control concurrency
-    semaphore = asyncio.Semaphore(max_concurrency)
+    missing_pages = sorted(set(page_nums) - page_blocks.keys())
+    if missing_pages:
+        logger.warning(f"No analysis results for pages {missing_pages}")
 
-    async def process_page_with_semaphore(page):
-        async with semaphore:
-            return await analyze_page_with_openai(
-                client=client,
-                page_num=page["page_num"],
-                page_text=page["text"],
-                image_base64=page["image_base64"],
-            )
+    logger.info(
+        f"Analysis complete. Identified {sum(len(p) for p in pages)} blocks "
+        f"across all pages"
+    )
+    return pages, missing_pages
 
-    # Create tasks for all pages
-    tasks = [process_page_with_semaphore(page) for page in page_data]
 
-    # Gather results
-    results = await asyncio.gather(*tasks)
+# Blocks that carry no meaning for retrieval.
+EMBED_SKIP_TYPES = {BlockType.HEADER, BlockType.FOOTER, BlockType.PAGE_NUMBER}
 
-    # Combine all blocks from all pages
-    for page_blocks in results:
-        all_blocks.extend(page_blocks)
+# Blocks whose content is HTML markup.
+EMBED_HTML_TYPES = {BlockType.TABLE, BlockType.FIGURE}
 
-    logger.info(
-        f"Analysis complete. Identified {len(all_blocks)} blocks across all pages"
-    )
-    return all_blocks
+# The description is capped at 1024 output tokens, so more input than this
+# rarely changes it.
+EMBED_MAX_INPUT_CHARS = 3000
+
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _strip_html(content: str) -> str:
+    text = html.unescape(_HTML_TAG_RE.sub(" ", content))
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def _embed_input(page_blocks: List[DocumentBlock]) -> str:
+    """
+    Build the text sent to the model to describe a page: drops headers,
+    footers and page numbers, strips markup from tables and figures, and
+    truncates the result.
+    """
+    parts = []
+    for block in page_blocks:
+        if block.type in EMBED_SKIP_TYPES or not block.content:
+            continue
+        if block.type in EMBED_HTML_TYPES:
+            parts.append(_strip_html(block.content))
+        else:
+            parts.append(block.content)
+
+    text = "\n".join(parts)
+    if len(text) > EMBED_MAX_INPUT_CHARS:
+        text = text[:EMBED_MAX_INPUT_CHARS] + "…(truncated)"
+    return text
 
 
 async def process_page(page_num: int, page_blocks: list, client) -> DocumentChunk:
@@ -363,23 +703,37 @@ async def process_page(page_num: int, page_blocks: list, client) -> DocumentChun
         [block.content for block in page_blocks if block.content]
     )
 
-    prompt = """
-    Create a detailed semantic description of this page content
-    optimized for vector embedding and semantic search. Include key
-    concepts, entities, relationships, and main ideas. Be
-    comprehensive but focused.
-    """
+    embed_input = _embed_input(page_blocks)
+    if not embed_input:
+        # Only headers, footers, page numbers or images: there is nothing to
+        # describe, so use the blocks' own descriptions
+        embed_text = "\n".join(
+            block.semantic_content
+            for block in page_blocks
+            if block.semantic_content
+        )
+        return DocumentChunk(
+            content=content, embed=embed_text or content, blocks=page_blocks
+        )
+
+    cache_key = PageCache.key("embed", MODEL, embed_input)
+    embed_text = page_cache.get(cache_key)
+    if embed_text is not None:
+        logger.info(f"Cache hit for embedding text of page {page_num}")
+        return DocumentChunk(
+            content=content, embed=embed_text, blocks=page_blocks
+        )
+
     response = await client.chat.completions.create(
-        model="gpt-4.1-mini-2025-04-14",
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": content},
-        ],
+        model=MODEL,
+        messages=[*_EMBED_MESSAGES, {"role": "user", "content": embed_input}],
         temperature=0,
         max_tokens=1024,
     )
 
     embed_text = response.choices[0].message.content
+    if embed_text is not None:
+        page_cache.set(cache_key, embed_text)
     logger.info(f"Generated embedding text for page {page_num}")
     return DocumentChunk(
         content=content, embed=embed_text, blocks=page_blocks
@@ -387,7 +741,8 @@ async def process_page(page_num: int, page_blocks: list, client) -> DocumentChun
 
 
 async def create_chunks_from_blocks(
-    blocks: List[DocumentBlock],
+    pages: List[List[DocumentBlock]],
+    client: AsyncOpenAI,
     mode: Literal[
         "page", "block"
     ] = "page", 
@@ -397,25 +752,16 @@ async def create_chunks_from_blocks(
     generating an embedding-optimized description for each page.
 
     Args:
-        blocks: List of DocumentBlock objects
+        pages: Non-empty lists of DocumentBlock objects, one per page, as
+            returned by `analyze_with_openai`
         client: AsyncOpenAI client instance
 
     Returns:
         List of DocumentChunk objects
     """
-    logger.info(f"Creating chunks from {len(blocks)} blocks")
-
-    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    logger.info(f"Creating chunks from {len(pages)} pages")
 
     if mode == "page":
-        # Group blocks by page
-        pages = {}
-        for block in blocks:
-            page_num = block.page_num
-            if page_num not in pages:
-                pages[page_num] = []
-            pages[page_num].append(block)
-
         # Create a semaphore to limit concurrency
         semaphore = asyncio.Semaphore(10)  # Limit to 10 concurrent requests
 
@@ -425,18 +771,19 @@ async def create_chunks_from_blocks(
 
         # Process pages in parallel with concurrency control
         tasks = [
-            process_page_with_semaphore(page_num, page_blocks)
-            for page_num, page_blocks in pages.items()
+            process_page_with_semaphore(page_blocks[0].page_num, page_blocks)
+            for page_blocks in pages
         ]
         chunks = await asyncio.gather(*tasks)
     else:
         chunks = [
-            DocumentChunk(
+            DocumentChunk.model_construct(
                 content=block.content,
                 embed=block.semantic_content,
                 blocks=[block],
             )
-            for block in blocks
+            for page_blocks in pages
+            for block in page_blocks
         ]
 
     logger.info(f"Created {len(chunks)} chunks")
@@ -453,24 +800,26 @@ async def parse_pdf(
         pdf_bytes: The raw PDF bytes to parse
 
     Returns:
-        A ParsedDocument containing the hierarchical structure of document content
+        A ParsedDocument containing the hierarchical structure of document
+        content. Pages that could not be analyzed are left out of the chunks
+        and listed in `missing_pages`.
     """
     logger.info("Starting async PDF parsing process")
     try:
-        # Load the document from bytes
-        document = await load_pdf(pdf_bytes)
+        client = get_openai_client()
 
-        # Extract text and images from each page
-        page_data = await extract_page_data(document)
-
-        # Use OpenAI to analyze the content and identify blocks asynchronously
-        blocks = await analyze_with_openai(page_data)
+        # Render pages and analyze them with OpenAI as they become available
+        pages, missing_pages = await analyze_with_openai(
+            extract_page_data(pdf_bytes), client=client
+        )
 
         # Organize blocks into chunks
-        chunks = await create_chunks_from_blocks(blocks, mode="page")
+        chunks = await create_chunks_from_blocks(
+            pages, client=client, mode="page"
+        )
 
         logger.info("Async PDF parsing completed successfully")
-        return ParsedDocument(chunks=chunks)
+        return ParsedDocument(chunks=chunks, missing_pages=missing_pages)
     except Exception as e:
         logger.error(f"Async PDF parsing failed: {str(e)}")
         raise
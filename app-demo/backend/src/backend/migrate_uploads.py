@@ -0,0 +1,40 @@
+"""
+Move uploads stored flat in UPLOAD_DIR (named by the dashed UUID) to their
+sharded location.
+
+Run once from the directory containing UPLOAD_DIR:
+
+    PYTHONPATH=src python -m backend.migrate_uploads
+"""
+
+import logging
+import os
+import uuid
+
+from backend.routers.files import UPLOAD_DIR, get_upload_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def migrate_uploads() -> int:
+    moved = 0
+    with os.scandir(UPLOAD_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            try:
+                file_id = uuid.UUID(entry.name)
+            except ValueError:
+                continue
+
+            target = get_upload_path(file_id)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(entry.path, target)
+            moved += 1
+
+    return moved
+
+
+if __name__ == "__main__":
+    logger.info(f"Moved {migrate_uploads()} files into sharded directories")
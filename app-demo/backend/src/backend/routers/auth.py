@@ -1,12 +1,18 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
+import hashlib
+import time
 from typing import Annotated
+import uuid
 
+from cachetools import TTLCache
 import jwt
 from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jwt.exceptions import InvalidTokenError as JWTError
 from passlib.context import CryptContext
 from pydantic import BaseModel
+from sqlalchemy import bindparam, select
 from sqlalchemy.exc import IntegrityError
 from backend.database import db_dependency
 from backend.models import User
@@ -18,6 +24,10 @@ SECRET_KEY = "f33efd136032819f6017e92272c14afc941eca4fbb94ca266b1d8fa5d8d91107"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Reused for every decode instead of going through the module-level helper
+_JWT = jwt.PyJWT()
+_ALGORITHMS = [ALGORITHM]
+
 
 class Token(BaseModel):
     access_token: str
@@ -28,32 +38,83 @@ class TokenData(BaseModel):
     username: str | None = None
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# argon2 hashes new passwords; existing bcrypt hashes still verify and are
+# flagged as deprecated.
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+)
+
+# Recently verified logins, so clients that re-authenticate repeatedly skip the
+# password hash. Keys are BLAKE2b digests keyed with SECRET_KEY, so the cache
+# can't be used as a password list. Values hold the user's id and password
+# hash at verification time; a changed hash invalidates the entry.
+_AUTH_CACHE: TTLCache[bytes, tuple[uuid.UUID, str]] = TTLCache(
+    maxsize=10_000, ttl=30
+)
+
+# Access tokens that were recently verified, so repeat requests skip the
+# signature check and the user lookup by email. Keys are SHA-256 digests of
+# the token; values hold the user's id and email and the token's expiry,
+# which is checked on every hit so an entry never outlives its token.
+_TOKEN_CACHE: TTLCache[bytes, tuple[uuid.UUID, str, float]] = TTLCache(
+    maxsize=10_000, ttl=30
+)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Hashing is CPU-bound; run it in a worker thread so it doesn't block the
+# event loop and concurrent logins can hash in parallel.
+async def verify_password(plain_password, hashed_password):
+    return await asyncio.to_thread(
+        pwd_context.verify, plain_password, hashed_password
+    )
+
+
+async def get_password_hash(password):
+    return await asyncio.to_thread(pwd_context.hash, password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# Built once so SQLAlchemy's compiled-statement cache is hit on every lookup.
+_USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
 
 
 def get_user(db: db_dependency, username: str):
-    user = db.query(User).filter(User.email == username).first()
+    user = db.execute(_USER_BY_EMAIL, {"email": username}).scalar_one_or_none()
     return user
 
 
-def authenticate_user(db: db_dependency, username: str, password: str):
+def _auth_cache_key(username: str, password: str) -> bytes:
+    return hashlib.blake2b(
+        f"{username}:{password}".encode(), key=bytes.fromhex(SECRET_KEY)
+    ).digest()
+
+
+async def authenticate_user(db: db_dependency, username: str, password: str):
+    cache_key = _auth_cache_key(username, password)
+    cached = _AUTH_CACHE.get(cache_key)
+    if cached is not None:
+        user_id, hashed_password = cached
+        user = db.get(User, user_id)
+        if user and user.hashed_password == hashed_password:
+            return user
+        _AUTH_CACHE.pop(cache_key, None)
+
     user = get_user(db, username)
     if not user:
+        # Spend the same time as a real verify so unknown emails can't be
+        # told apart by response time.
+        await asyncio.to_thread(pwd_context.dummy_verify)
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
+    _AUTH_CACHE[cache_key] = (user.id, user.hashed_password)
     return user
 
 
@@ -68,6 +129,59 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
+def get_token_identity(
+    db: db_dependency, token: str | None
+) -> tuple[uuid.UUID, str] | None:
+    """
+    Return the (user id, email) an access token was issued to, or None if the
+    token is missing, invalid or expired. Only tokens minted without a `uid`
+    claim need a database lookup.
+    """
+    if not token:
+        return None
+
+    cache_key = hashlib.sha256(token.encode()).digest()
+    cached = _TOKEN_CACHE.get(cache_key)
+    if cached is not None:
+        user_id, username, expires_at = cached
+        if time.time() < expires_at:
+            return user_id, username
+        _TOKEN_CACHE.pop(cache_key, None)
+
+    try:
+        payload = _JWT.decode(token, SECRET_KEY, algorithms=_ALGORITHMS)
+        username = payload.get("sub")
+        if username is None:
+            return None
+        token_data = TokenData(username=username)
+    except InvalidTokenError:
+        return None
+
+    if "uid" in payload:
+        user_id = uuid.UUID(payload["uid"])
+    else:
+        user = get_user(db, username=token_data.username)
+        if user is None:
+            return None
+        user_id = user.id
+
+    if "exp" in payload:
+        _TOKEN_CACHE[cache_key] = (user_id, token_data.username, payload["exp"])
+    return user_id, token_data.username
+
+
+def get_user_from_token(db: db_dependency, token: str | None) -> User | None:
+    """
+    Return the user an access token belongs to, or None if the token is
+    missing, invalid or expired, or the user no longer exists.
+    """
+    identity = get_token_identity(db, token)
+    if identity is None:
+        return None
+    user_id, _ = identity
+    return db.get(User, user_id)
+
+
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)], db: db_dependency
 ):
@@ -76,15 +190,7 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except InvalidTokenError:
-        raise credentials_exception
-    user = get_user(db, username=token_data.username)
+    user = get_user_from_token(db, token)
     if user is None:
         raise credentials_exception
     return user
@@ -98,15 +204,7 @@ async def get_current_user_from_cookie(request: Request, db: db_dependency):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(auth_token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except InvalidTokenError:
-        raise credentials_exception
-    user = get_user(db, username=token_data.username)
+    user = get_user_from_token(db, auth_token)
     if user is None:
         raise credentials_exception
     return user
@@ -117,7 +215,7 @@ async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     db: db_dependency,
 ) -> Token:
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -126,7 +224,8 @@ async def login_for_access_token(
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id.hex},
+        expires_delta=access_token_expires,
     )
     return Token(access_token=access_token, token_type="bearer")
 
@@ -140,7 +239,7 @@ class UserCreate(BaseModel):
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register(user: UserCreate, db: db_dependency):
     try:
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await get_password_hash(user.password)
         new_user = User(
             name=user.name, email=user.email, hashed_password=hashed_password
         )
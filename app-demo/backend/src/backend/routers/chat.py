@@ -1,43 +1,57 @@
 import asyncio
 import os
 import uuid
-import jwt
-from typing import Annotated, Any
+from typing import Annotated
 from fastapi import (
     APIRouter,
     WebSocket,
     status,
     Depends,
     WebSocketDisconnect,
+    WebSocketException,
 )
 
 from backend.database import db_dependency
-from backend.routers.auth import get_user, TokenData
-from backend.routers.auth import SECRET_KEY, ALGORITHM
+from backend.routers.auth import get_token_identity
 from backend.models import User
+import httpx
 from openai import AsyncOpenAI
+import orjson
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/ws", tags=["websocket"])
 
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Sized for many concurrent chat sockets; HTTP/2 lets streamed completions
+# share connections to the API.
+openai_client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=500,
+            max_keepalive_connections=200,
+            keepalive_expiry=60,
+        ),
+        http2=True,
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    ),
+)
 
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: list[WebSocket] = []
+        self.active_connections: set[WebSocket] = set()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
 
     async def disconnect(
         self, websocket: WebSocket, code: int = status.WS_1000_NORMAL_CLOSURE
     ):
         if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+            self.active_connections.discard(websocket)
             try:
                 await websocket.close(code=code)
             except RuntimeError:
@@ -47,47 +61,72 @@ class ConnectionManager:
     async def send_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
 
-    async def send_json(self, data: Any, websocket: WebSocket):
-        await websocket.send_json(data)
-
 
 manager = ConnectionManager()
 
+# Streamed deltas are buffered and sent at most this often, so each WebSocket
+# frame carries several tokens instead of one.
+CHUNK_FLUSH_INTERVAL = 0.02
 
-async def ws_get_current_user(
+# Pre-serialized control messages; message ids are hex UUIDs, so they need no
+# JSON escaping
+START_MESSAGE = '{"message_id":"%s","type":"start"}'
+END_MESSAGE = '{"message_id":"%s","type":"end"}'
+
+
+async def send_buffered_chunks(
     websocket: WebSocket,
-    db: db_dependency,
+    message_id: str,
+    buffer: list[str],
+    done: asyncio.Event,
 ):
-    auth_token = websocket.cookies.get("auth_token")
-    print(auth_token)
-    if not auth_token:
-        await manager.disconnect(websocket, status.WS_1008_POLICY_VIOLATION)
-        return None
+    """
+    Send the deltas collected in `buffer` as one chunk message every
+    CHUNK_FLUSH_INTERVAL seconds, until `done` is set and the buffer is empty.
+    """
+    # Only the content varies between chunk messages, so the rest of the JSON
+    # is built once
+    prefix = (
+        '{"message_id":'
+        + orjson.dumps(message_id).decode()
+        + ',"type":"chunk","content":'
+    )
+
+    while True:
+        try:
+            await asyncio.wait_for(done.wait(), CHUNK_FLUSH_INTERVAL)
+        except TimeoutError:
+            pass
+
+        if buffer:
+            content = orjson.dumps("".join(buffer)).decode()
+            buffer.clear()
+            await manager.send_message(prefix + content + "}", websocket)
+
+        if done.is_set():
+            return
 
-    try:
-        payload = jwt.decode(auth_token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        print(username)
-        if username is None:
-            await manager.disconnect(websocket, status.WS_1008_POLICY_VIOLATION)
-            return None
-        token_data = TokenData(username=username)
-    except jwt.InvalidTokenError:
-        await manager.disconnect(websocket, status.WS_1008_POLICY_VIOLATION)
-        return None
 
-    user = get_user(db, token_data.username)
-    if user is None:
-        await manager.disconnect(websocket, status.WS_1008_POLICY_VIOLATION)
-        return None
+async def ws_get_current_user(
+    websocket: WebSocket,
+    db: db_dependency,
+):
+    # The socket isn't accepted yet, so it is rejected by raising rather than
+    # through the connection manager
+    identity = get_token_identity(db, websocket.cookies.get("auth_token"))
+    if identity is None:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION)
 
-    return user
+    # The chat only needs the caller's identity, so return a detached User
+    # built from the token instead of loading the row
+    user_id, email = identity
+    return User(id=user_id, email=email)
 
 
 @router.websocket("/chat")
 async def websocket_endpoint(
     websocket: WebSocket,
-    current_user: Annotated[User | None, Depends(ws_get_current_user)],
+    current_user: Annotated[User, Depends(ws_get_current_user)],
 ):
     await manager.connect(websocket)
     try:
@@ -102,36 +141,32 @@ async def websocket_endpoint(
                 stream=True,
             )
 
-            message_id = str(uuid.uuid4())
+            message_id = uuid.uuid4().hex
 
-            await manager.send_json(
-                {
-                    "message_id": message_id,
-                    "type": "start",
-                },
-                websocket,
-            )
-            async for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    logger.info(chunk.choices[0].delta.content)
-                    content = chunk.choices[0].delta.content
-                    await manager.send_json(
-                        {
-                            "message_id": message_id,
-                            "type": "chunk",
-                            "content": content,
-                        },
-                        websocket,
-                    )
-                    await asyncio.sleep(0.01)
-
-            await manager.send_json(
-                {
-                    "message_id": message_id,
-                    "type": "end",
-                },
-                websocket,
+            await manager.send_message(START_MESSAGE % message_id, websocket)
+            buffer: list[str] = []
+            done = asyncio.Event()
+            sender = asyncio.create_task(
+                send_buffered_chunks(websocket, message_id, buffer, done)
             )
+            try:
+                async for chunk in stream:
+                    # The sender only finishes early if sending failed, e.g.
+                    # the client disconnected; stop reading the completion
+                    if sender.done():
+                        break
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if not content:
+                        continue
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("delta=%s", content)
+                    buffer.append(content)
+            finally:
+                done.set()
+                await stream.close()
+                await sender
+
+            await manager.send_message(END_MESSAGE % message_id, websocket)
 
     except WebSocketDisconnect:
         await manager.disconnect(websocket)
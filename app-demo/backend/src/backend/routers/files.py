@@ -1,26 +1,164 @@
+import asyncio
+from contextlib import asynccontextmanager
 import os
 from typing import Annotated
 import uuid
+from cachetools import TTLCache
 from backend.database import db_dependency
-from backend.document_parser import parse_pdf
+from backend.document_parser import ParsedDocument, parse_pdf
 from backend.models import File, User
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+    UploadFile,
+    status,
+)
 from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
 
 from backend.routers.auth import get_current_user
+from uuid6 import uuid7
 
 
 UPLOAD_DIR = "files"
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 << 20))
+
+# Stored files never change, so clients may cache downloads indefinitely
+DOWNLOAD_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Parsed documents by file id. Stored files are never modified in place, so
+# an id always maps to the same content.
+_parse_cache: TTLCache[uuid.UUID, ParsedDocument] = TTLCache(
+    maxsize=256, ttl=3600
+)
+
+
+class _ParseLock:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Requests holding or waiting for the lock
+        self.users = 0
+
+
+# One lock per file being parsed, so concurrent requests for the same file
+# wait for a single parse instead of each starting their own. An entry is
+# removed by the last request holding or waiting for its lock.
+_parse_locks: dict[uuid.UUID, _ParseLock] = {}
+
+
+@asynccontextmanager
+async def _parse_lock(file_id: uuid.UUID):
+    entry = _parse_locks.get(file_id)
+    if entry is None:
+        entry = _parse_locks[file_id] = _ParseLock()
+    entry.users += 1
+    try:
+        async with entry.lock:
+            yield
+    finally:
+        entry.users -= 1
+        if entry.users == 0:
+            del _parse_locks[file_id]
+
 
 router = APIRouter(prefix="/files", tags=["files"])
 
 
+class ZeroCopyFileResponse(FileResponse):
+    """
+    FileResponse that hands the open file to the server through the ASGI
+    `http.response.zerocopysend` extension, so the body is sent with
+    sendfile(2) instead of being copied through Python. Falls back to the
+    regular FileResponse when the server doesn't support the extension, and
+    for HEAD and range requests.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            "http.response.zerocopysend" not in scope.get("extensions", {})
+            or scope["method"].upper() == "HEAD"
+            or "range" in Headers(scope=scope)
+        ):
+            await super().__call__(scope, receive, send)
+            return
+
+        file = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            if self.stat_result is None:
+                self.stat_result = os.fstat(file.fileno())
+                self.set_stat_headers(self.stat_result)
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            await send(
+                {
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "count": self.stat_result.st_size,
+                    "more_body": False,
+                }
+            )
+        finally:
+            file.close()
+
+        if self.background is not None:
+            await self.background()
+
+
+def get_upload_path(file_id: uuid.UUID) -> str:
+    """
+    Path a file's content is stored at. Files are sharded into two levels of
+    subdirectories so no directory grows past a few thousand entries. The
+    shards use the last hex digits of the id, since the leading digits of a
+    UUIDv7 are a timestamp.
+    """
+    name = file_id.hex
+    return os.path.join(UPLOAD_DIR, name[-2:], name[-4:-2], name)
+
+
+# Blocking filesystem helpers, run in worker threads so disk I/O doesn't
+# stall the event loop.
+def _read_file(path: str) -> bytes | None:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _stat_file(path: str) -> os.stat_result | None:
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _remove_if_exists(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
 class FileMetadataResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: uuid.UUID
     name: str
     content_type: str
@@ -32,7 +170,12 @@ async def list_files(
     current_user: Annotated[User, Depends(get_current_user)],
     db: db_dependency,
 ):
-    files = db.query(File).filter(File.user_id == current_user.id).all()
+    # Only select the columns the response needs
+    files = db.execute(
+        select(File.id, File.name, File.content_type, File.size).where(
+            File.user_id == current_user.id
+        )
+    ).all()
     return files
 
 
@@ -43,73 +186,134 @@ async def list_files(
 )
 async def upload_file(
     file: UploadFile,
+    request: Request,
     current_user: Annotated[User, Depends(get_current_user)],
     db: db_dependency,
 ):
+    too_large_exception = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File exceeds the {MAX_UPLOAD_BYTES} byte upload limit",
+    )
+
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        raise too_large_exception
+
+    file_id = uuid7()
+    file_path = get_upload_path(file_id)
+    tmp_path = os.path.join(
+        os.path.dirname(file_path), f".{os.path.basename(file_path)}.part"
+    )
+
+    # Write the content first so a committed row always has its file
     try:
-        content = await file.read()
+        # Stream the upload to disk instead of reading it into memory
+        size = 0
+        await asyncio.to_thread(
+            os.makedirs, os.path.dirname(file_path), exist_ok=True
+        )
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                # Content-Length may be missing or wrong
+                if size > MAX_UPLOAD_BYTES:
+                    raise too_large_exception
+                await asyncio.to_thread(f.write, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.replace, tmp_path, file_path)
+    except HTTPException:
+        await asyncio.to_thread(_remove_if_exists, tmp_path)
+        raise
+    except Exception as e:
+        await asyncio.to_thread(_remove_if_exists, tmp_path)
+
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to upload file: {str(e)}",
+        )
 
+    try:
         new_file = File(
+            id=file_id,
             user_id=current_user.id,
             name=file.filename,
             content_type=file.content_type,
-            size=len(content),
+            size=size,
         )
 
         db.add(new_file)
         db.commit()
-        db.refresh(new_file)
-
-        file_path = os.path.join(UPLOAD_DIR, str(new_file.id))
-        with open(file_path, "wb") as f:
-            f.write(content)
-
-        return new_file
     except SQLAlchemyError:
         db.rollback()
+        await asyncio.to_thread(os.remove, file_path)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create file record",
         )
-    except Exception as e:
-        if "new_file" in locals() and new_file.id:
-            db.delete(new_file)
-            db.commit()
 
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to upload file: {str(e)}",
-        )
+    # Built from local values; reading new_file after commit would reload it
+    return FileMetadataResponse(
+        id=file_id, name=file.filename, content_type=file.content_type, size=size
+    )
 
 
 @router.get("/{file_id}/download")
 async def download_file(
     file_id: uuid.UUID,
+    request: Request,
     current_user: Annotated[User, Depends(get_current_user)],
     db: db_dependency,
 ):
-    file = db.query(File).filter(File.id == file_id).first()
+    # Stat the file in a worker thread while the ownership query runs. The
+    # executor is used directly so the stat starts before the (blocking) query.
+    file_path = get_upload_path(file_id)
+    loop = asyncio.get_running_loop()
+    stat_future = loop.run_in_executor(None, _stat_file, file_path)
+
+    # Files of other users are reported as not found
+    file = (
+        db.query(File)
+        .filter(File.id == file_id, File.user_id == current_user.id)
+        .first()
+    )
 
     if not file:
+        stat_future.cancel()
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
         )
 
-    if file.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to access this file",
-        )
-
-    file_path = os.path.join(UPLOAD_DIR, str(file_id))
-    if not os.path.exists(file_path):
+    cache_headers = {
+        "ETag": f'"{file_id.hex}"',
+        "Cache-Control": DOWNLOAD_CACHE_CONTROL,
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etags = {
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        }
+        if cache_headers["ETag"] in etags or "*" in etags:
+            stat_future.cancel()
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers
+            )
+
+    # Passed on so the response doesn't stat the file again
+    stat_result = await stat_future
+    if stat_result is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="File content not found",
         )
 
-    return FileResponse(
-        path=file_path, media_type=file.content_type, filename=file.name
+    return ZeroCopyFileResponse(
+        path=file_path,
+        media_type=file.content_type,
+        filename=file.name,
+        stat_result=stat_result,
+        headers=cache_headers,
     )
 
 
@@ -119,26 +323,26 @@ async def delete_file(
     current_user: Annotated[User, Depends(get_current_user)],
     db: db_dependency,
 ):
-    file = db.query(File).filter(File.id == file_id).first()
+    # Files of other users are reported as not found
+    file = (
+        db.query(File)
+        .filter(File.id == file_id, File.user_id == current_user.id)
+        .first()
+    )
 
     if not file:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
         )
 
-    if file.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to access this file",
-        )
-
     try:
         db.delete(file)
         db.commit()
 
-        file_path = os.path.join(UPLOAD_DIR, str(file_id))
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        _parse_cache.pop(file_id, None)
+
+        file_path = get_upload_path(file_id)
+        await asyncio.to_thread(_remove_if_exists, file_path)
 
         return None
 
@@ -156,29 +360,52 @@ async def parse_file(
     current_user: Annotated[User, Depends(get_current_user)],
     db: db_dependency,
 ):
-    file = db.query(File).filter(File.id == file_id).first()
-
-    if not file:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
+    # Unless the result is cached, read the file in a worker thread while the
+    # ownership query runs. The executor is used directly so the read starts
+    # before the (blocking) query.
+    read_future = None
+    parsed_document = _parse_cache.get(file_id)
+    if parsed_document is None:
+        loop = asyncio.get_running_loop()
+        read_future = loop.run_in_executor(
+            None, _read_file, get_upload_path(file_id)
         )
 
-    if file.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to access this file",
-        )
+    # Files of other users are reported as not found
+    file = (
+        db.query(File)
+        .filter(File.id == file_id, File.user_id == current_user.id)
+        .first()
+    )
 
-    file_path = os.path.join(UPLOAD_DIR, str(file_id))
-    if not os.path.exists(file_path):
+    if not file:
+        if read_future is not None:
+            read_future.cancel()
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="File content not found",
+            status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
         )
 
-    with open(file_path, "rb") as f:
-        pdf_bytes = f.read()
-
-    parsed_document = await parse_pdf(pdf_bytes)
+    if parsed_document is not None:
+        return parsed_document
+
+    async with _parse_lock(file_id):
+        # Another request may have parsed it while we waited
+        parsed_document = _parse_cache.get(file_id)
+        if parsed_document is not None:
+            read_future.cancel()
+            return parsed_document
+
+        pdf_bytes = await read_future
+        if pdf_bytes is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File content not found",
+            )
+
+        parsed_document = await parse_pdf(pdf_bytes)
+        # Partial results are returned but not cached, so the missing
+        # pages are retried on the next request
+        if not parsed_document.missing_pages:
+            _parse_cache[file_id] = parsed_document
 
     return parsed_document
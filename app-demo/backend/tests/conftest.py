@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+# The app reads its configuration at import time, so point it at a throwaway
+# SQLite database before anything from backend is imported.
+_TMP_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP_DIR, 'test.db')}"
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+# The files router creates its upload directory relative to the working
+# directory on import
+_cwd = os.getcwd()
+os.chdir(_TMP_DIR)
+try:
+    from backend.database import Base, engine
+    from backend.main import app
+    from backend.routers import auth, files
+finally:
+    os.chdir(_cwd)
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(autouse=True)
+def reset_state(tmp_path, monkeypatch):
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(files, "UPLOAD_DIR", str(tmp_path / "files"))
+    auth._AUTH_CACHE.clear()
+    auth._TOKEN_CACHE.clear()
+    files._parse_cache.clear()
+    files._parse_locks.clear()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def register(client, email, password="secret"):
+    response = client.post(
+        "/auth/register",
+        json={"name": email.split("@")[0], "email": email, "password": password},
+    )
+    assert response.status_code == 201
+
+
+def login(client, email, password="secret"):
+    return client.post(
+        "/auth/token", data={"username": email, "password": password}
+    )
+
+
+def auth_headers(client, email, password="secret"):
+    response = login(client, email, password)
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def alice(client):
+    register(client, "alice@example.com")
+    return auth_headers(client, "alice@example.com")
+
+
+@pytest.fixture
+def bob(client):
+    register(client, "bob@example.com")
+    return auth_headers(client, "bob@example.com")
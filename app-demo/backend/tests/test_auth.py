@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import jwt
+from passlib.hash import bcrypt
+
+from backend.database import SessionLocal
+from backend.routers import auth
+
+from .conftest import login, register
+
+
+def test_cached_login_dropped_when_password_changes(client):
+    register(client, "alice@example.com", "old-password")
+    assert login(client, "alice@example.com", "old-password").status_code == 200
+    assert len(auth._AUTH_CACHE) == 1
+
+    with SessionLocal() as db:
+        user = auth.get_user(db, "alice@example.com")
+        user.hashed_password = auth.pwd_context.hash("new-password")
+        db.commit()
+
+    assert login(client, "alice@example.com", "old-password").status_code == 401
+    assert len(auth._AUTH_CACHE) == 0
+    assert login(client, "alice@example.com", "new-password").status_code == 200
+
+
+def test_bcrypt_hashes_still_verify(client):
+    register(client, "alice@example.com")
+    with SessionLocal() as db:
+        user = auth.get_user(db, "alice@example.com")
+        user.hashed_password = bcrypt.hash("secret")
+        db.commit()
+
+    assert login(client, "alice@example.com").status_code == 200
+    assert login(client, "alice@example.com", "wrong").status_code == 401
+
+
+def test_login_rejects_wrong_password_and_unknown_user(client):
+    register(client, "alice@example.com")
+
+    assert login(client, "alice@example.com", "wrong").status_code == 401
+    assert login(client, "nobody@example.com").status_code == 401
+    assert len(auth._AUTH_CACHE) == 0
+
+
+def test_token_auth_served_from_cache(client, alice, monkeypatch):
+    assert client.get("/files", headers=alice).status_code == 200
+    assert len(auth._TOKEN_CACHE) == 1
+
+    # A cache hit neither decodes the token nor looks the user up by email
+    def fail(*args, **kwargs):
+        raise AssertionError("token decoded again")
+
+    monkeypatch.setattr(auth._JWT, "decode", fail)
+    monkeypatch.setattr(auth, "get_user", fail)
+    assert client.get("/files", headers=alice).status_code == 200
+
+
+def test_expired_token_rejected_on_cache_hit(client, alice, monkeypatch):
+    assert client.get("/files", headers=alice).status_code == 200
+    token = alice["Authorization"].removeprefix("Bearer ")
+    expires_at = jwt.decode(token, options={"verify_signature": False})["exp"]
+
+    # Past the expiry the token is still cached, but the entry must not be
+    # used; decoding it would fail as well by then
+    def decode(*args, **kwargs):
+        raise jwt.ExpiredSignatureError("Signature has expired")
+
+    monkeypatch.setattr(auth, "time", SimpleNamespace(time=lambda: expires_at + 1))
+    monkeypatch.setattr(auth._JWT, "decode", decode)
+    assert client.get("/files", headers=alice).status_code == 401
+    assert len(auth._TOKEN_CACHE) == 0
+
+
+def test_token_of_deleted_user_rejected(client, alice):
+    assert client.get("/files", headers=alice).status_code == 200
+
+    with SessionLocal() as db:
+        db.delete(auth.get_user(db, "alice@example.com"))
+        db.commit()
+
+    assert client.get("/files", headers=alice).status_code == 401
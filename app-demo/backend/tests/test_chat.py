@@ -0,0 +1,116 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import WebSocketDisconnect, status
+
+from backend.routers import chat
+
+
+@pytest.mark.parametrize("cookies", [{}, {"auth_token": "not-a-token"}])
+def test_chat_rejects_unauthenticated(client, cookies):
+    client.cookies.update(cookies)
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with client.websocket_connect("/ws/chat"):
+            pass
+    assert exc_info.value.code == status.WS_1008_POLICY_VIOLATION
+    assert not chat.manager.active_connections
+
+
+def test_chat_accepts_token_cookie(client, alice):
+    token = alice["Authorization"].removeprefix("Bearer ")
+    client.cookies.set("auth_token", token)
+
+    with client.websocket_connect("/ws/chat"):
+        assert len(chat.manager.active_connections) == 1
+
+
+class FakeStream:
+    """Streamed completion yielding one delta per chunk."""
+
+    def __init__(self, deltas, delay=0.0):
+        self.deltas = deltas
+        self.delay = delay
+        self.consumed = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        # A chunk without choices, as sent with usage stats
+        yield SimpleNamespace(choices=[])
+        for delta in self.deltas:
+            await asyncio.sleep(self.delay)
+            self.consumed += 1
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))]
+            )
+
+    async def close(self):
+        self.closed = True
+
+
+def fake_openai(monkeypatch, stream):
+    async def create(**kwargs):
+        return stream
+
+    monkeypatch.setattr(
+        chat,
+        "openai_client",
+        SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        ),
+    )
+
+
+def connect(client, headers):
+    token = headers["Authorization"].removeprefix("Bearer ")
+    client.cookies.set("auth_token", token)
+    return client.websocket_connect("/ws/chat")
+
+
+def test_chat_streams_coalesced_deltas(client, alice, monkeypatch):
+    deltas = ["Hel", "lo", None, "", " wor", "ld", "\"!\"\n"] * 20
+    stream = FakeStream(deltas, delay=0.001)
+    fake_openai(monkeypatch, stream)
+
+    with connect(client, alice) as websocket:
+        websocket.send_text("hi")
+        messages = []
+        while not messages or messages[-1]["type"] != "end":
+            messages.append(json.loads(websocket.receive_text()))
+
+    start, *chunks, end = messages
+    assert start["type"] == "start"
+    assert {m["message_id"] for m in messages} == {start["message_id"]}
+    assert all(m["type"] == "chunk" for m in chunks)
+    assert "".join(m["content"] for m in chunks) == "".join(filter(None, deltas))
+    # Deltas arriving within a flush interval share a frame
+    assert len(chunks) < len([d for d in deltas if d])
+    assert stream.closed
+
+
+def test_chat_stops_reading_completion_when_send_fails(client, alice, monkeypatch):
+    stream = FakeStream(["token"] * 10_000, delay=0.001)
+    fake_openai(monkeypatch, stream)
+
+    send_message = chat.manager.send_message
+
+    async def failing_send_message(message, websocket):
+        if '"type":"chunk"' in message:
+            raise WebSocketDisconnect()
+        await send_message(message, websocket)
+
+    monkeypatch.setattr(chat.manager, "send_message", failing_send_message)
+
+    with connect(client, alice) as websocket:
+        websocket.send_text("hi")
+        assert json.loads(websocket.receive_text())["type"] == "start"
+        with pytest.raises(WebSocketDisconnect):
+            websocket.receive_text()
+
+    assert stream.closed
+    assert stream.consumed < 1000
+    assert not chat.manager.active_connections
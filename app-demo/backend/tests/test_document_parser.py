@@ -0,0 +1,282 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pymupdf
+import pytest
+
+from backend import document_parser
+from backend.document_parser import (
+    AIDocumentBlockSchema,
+    AIDocumentPageSchema,
+    AIDocumentParseResponseSchema,
+    BlockType,
+    PageCache,
+)
+
+_PAGE_TEXT_RE = re.compile(r"Page (\d+) text: ```(.*)```", re.DOTALL)
+
+
+def page_text(page_num):
+    # Page 1 is too short to be sent as text only, so it is also rasterized
+    if page_num == 1:
+        return "Cover page"
+    return f"This is page {page_num}. " + "Lorem ipsum dolor sit amet. " * 10
+
+
+def make_pdf(page_count):
+    document = pymupdf.open()
+    for page_num in range(1, page_count + 1):
+        page = document.new_page()
+        page.insert_textbox(page.rect + (72, 72, -72, -72), page_text(page_num))
+    return document.tobytes()
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+class FakeOpenAI:
+    """
+    Stands in for AsyncOpenAI. Parse requests get one text block per page,
+    holding the text the page was sent with, so results can be matched back
+    to their pages.
+    """
+
+    def __init__(self, fail_pages=(), refuse_pages=(), omit_pages=()):
+        self.fail_pages = set(fail_pages)
+        self.refuse_pages = set(refuse_pages)
+        self.omit_pages = set(omit_pages)
+        self.parse_requests: list[list[int]] = []
+        self.image_pages: list[int] = []
+        self.embed_requests: list[str] = []
+        self.beta = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse))
+        )
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self._create)
+        )
+
+    async def _parse(self, model, messages, response_format):
+        texts = {}
+        for part in messages[-1]["content"]:
+            if part["type"] == "image_url":
+                self.image_pages.append(list(texts)[-1])
+            elif match := _PAGE_TEXT_RE.match(part["text"]):
+                texts[int(match.group(1))] = match.group(2)
+        page_nums = list(texts)
+        self.parse_requests.append(page_nums)
+
+        if self.fail_pages & set(page_nums):
+            raise RuntimeError("Service unavailable")
+
+        refusal = None
+        if self.refuse_pages & set(page_nums):
+            refusal = "I can't help with that"
+        pages = [
+            AIDocumentPageSchema(
+                page_num=page_num,
+                blocks=[
+                    AIDocumentBlockSchema(
+                        type=BlockType.TEXT,
+                        content=text.strip(),
+                        semantic_content=f"Text of page {page_num}",
+                    )
+                ],
+            )
+            for page_num, text in texts.items()
+            if page_num not in self.omit_pages
+        ]
+        message = SimpleNamespace(
+            refusal=refusal,
+            parsed=AIDocumentParseResponseSchema(pages=pages),
+        )
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    async def _create(self, model, messages, **kwargs):
+        embed_input = messages[-1]["content"]
+        self.embed_requests.append(embed_input)
+        message = SimpleNamespace(content=f"Description of: {embed_input[:40]}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture(autouse=True)
+def empty_page_cache(monkeypatch):
+    monkeypatch.setattr(document_parser, "page_cache", PageCache())
+
+
+def parse(pdf_bytes, client, monkeypatch):
+    monkeypatch.setattr(document_parser, "get_openai_client", lambda: client)
+    return asyncio.run(document_parser.parse_pdf(pdf_bytes))
+
+
+def assert_chunks_match_pages(parsed, page_nums):
+    assert [chunk.blocks[0].page_num for chunk in parsed.chunks] == page_nums
+    for chunk in parsed.chunks:
+        page_num = chunk.blocks[0].page_num
+        assert all(block.page_num == page_num for block in chunk.blocks)
+        assert normalize(chunk.content) == normalize(page_text(page_num))
+
+
+def test_parse_pdf_batches_pages(monkeypatch):
+    client = FakeOpenAI()
+    parsed = parse(make_pdf(23), client, monkeypatch)
+
+    assert_chunks_match_pages(parsed, list(range(1, 24)))
+    assert parsed.missing_pages == []
+
+    # Every page is sent exactly once, at most 10 per request
+    assert sorted(sum(client.parse_requests, [])) == list(range(1, 24))
+    assert len(client.parse_requests) == 3
+    assert all(len(request) <= 10 for request in client.parse_requests)
+    assert client.image_pages == [1]
+    assert len(client.embed_requests) == 23
+
+
+def test_failed_batch_pages_reported_missing(monkeypatch):
+    client = FakeOpenAI(fail_pages={12})
+    parsed = parse(make_pdf(23), client, monkeypatch)
+
+    [failed] = [request for request in client.parse_requests if 12 in request]
+    assert parsed.missing_pages == sorted(failed)
+    assert_chunks_match_pages(
+        parsed, [n for n in range(1, 24) if n not in failed]
+    )
+
+
+def test_refused_batch_pages_reported_missing(monkeypatch):
+    client = FakeOpenAI(refuse_pages={3})
+    parsed = parse(make_pdf(15), client, monkeypatch)
+
+    [refused] = [request for request in client.parse_requests if 3 in request]
+    assert parsed.missing_pages == sorted(refused)
+    assert_chunks_match_pages(
+        parsed, [n for n in range(1, 16) if n not in refused]
+    )
+
+
+def test_page_left_out_of_response_reported_missing(monkeypatch):
+    client = FakeOpenAI(omit_pages={7})
+    parsed = parse(make_pdf(12), client, monkeypatch)
+
+    assert parsed.missing_pages == [7]
+    assert_chunks_match_pages(parsed, [n for n in range(1, 13) if n != 7])
+
+
+def test_render_ahead_is_bounded(monkeypatch):
+    pdf_bytes = make_pdf(30)
+    in_flight = 0
+    max_in_flight = 0
+    render = document_parser._render_page_in_pool
+
+    async def counting_render(pdf_bytes, page_num):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            return await render(pdf_bytes, page_num)
+        finally:
+            in_flight -= 1
+
+    async def consume_slowly():
+        page_nums = []
+        async for page in document_parser.extract_page_data(pdf_bytes):
+            page_nums.append(page["page_num"])
+            await asyncio.sleep(0.01)
+        return page_nums
+
+    monkeypatch.setattr(document_parser, "_render_page_in_pool", counting_render)
+    assert sorted(asyncio.run(consume_slowly())) == list(range(1, 31))
+    assert max_in_flight <= document_parser.RENDER_AHEAD
+
+
+def test_page_cache_key():
+    key = PageCache.key("parse", "model", "ab", "c")
+    assert key == PageCache.key("parse", "model", "ab", "c")
+    assert key != PageCache.key("parse", "model", "a", "bc")
+    assert key != PageCache.key("embed", "model", "ab", "c")
+    assert key != PageCache.key("parse", "other-model", "ab", "c")
+
+
+def test_reparse_served_from_page_cache(monkeypatch):
+    pdf_bytes = make_pdf(12)
+    first = parse(pdf_bytes, FakeOpenAI(), monkeypatch)
+
+    client = FakeOpenAI()
+    second = parse(pdf_bytes, client, monkeypatch)
+
+    assert client.parse_requests == []
+    assert client.embed_requests == []
+    assert second == first
+
+
+def test_failed_pages_not_cached(monkeypatch):
+    pdf_bytes = make_pdf(12)
+    first = parse(pdf_bytes, FakeOpenAI(omit_pages={7}), monkeypatch)
+    assert first.missing_pages == [7]
+
+    # Only the page that failed is sent again
+    client = FakeOpenAI()
+    second = parse(pdf_bytes, client, monkeypatch)
+    assert client.parse_requests == [[7]]
+    assert len(client.embed_requests) == 1
+    assert second.missing_pages == []
+    assert_chunks_match_pages(second, list(range(1, 13)))
+
+
+def block(type, content, semantic_content=""):
+    return document_parser.DocumentBlock(
+        type=type, page_num=1, content=content, semantic_content=semantic_content
+    )
+
+
+def test_embed_input_drops_page_furniture_and_markup():
+    blocks = [
+        block(BlockType.HEADER, "Annual report"),
+        block(BlockType.TITLE, "Results"),
+        block(BlockType.IMAGE, ""),
+        block(
+            BlockType.TABLE,
+            "<table><tr><th>Q1</th><th>Q2</th></tr>"
+            "<tr><td>1 &amp; 2</td><td>3</td></tr></table>",
+        ),
+        block(BlockType.TEXT, "Revenue grew."),
+        block(BlockType.PAGE_NUMBER, "4"),
+        block(BlockType.FOOTER, "Confidential"),
+    ]
+
+    assert document_parser._embed_input(blocks) == (
+        "Results\nQ1 Q2 1 & 2 3\nRevenue grew."
+    )
+
+
+def test_embed_input_truncated():
+    text = "x" * (document_parser.EMBED_MAX_INPUT_CHARS + 100)
+    embed_input = document_parser._embed_input([block(BlockType.TEXT, text)])
+
+    assert embed_input.startswith("x" * document_parser.EMBED_MAX_INPUT_CHARS)
+    assert embed_input.endswith("…(truncated)")
+    assert len(embed_input) < len(text)
+
+
+@pytest.mark.parametrize(
+    "blocks, embed",
+    [
+        (
+            [
+                block(BlockType.HEADER, "Annual report", "Report title"),
+                block(BlockType.PAGE_NUMBER, "4", "Page number 4"),
+            ],
+            "Report title\nPage number 4",
+        ),
+        ([block(BlockType.IMAGE, "", "A bar chart")], "A bar chart"),
+        ([block(BlockType.FOOTER, "Confidential")], "Confidential"),
+    ],
+)
+def test_page_without_embed_input_not_sent(blocks, embed):
+    client = FakeOpenAI()
+    chunk = asyncio.run(document_parser.process_page(1, blocks, client))
+
+    assert client.embed_requests == []
+    assert chunk.embed == embed
+    assert chunk.blocks == blocks
@@ -0,0 +1,311 @@
+import asyncio
+import os
+import uuid
+
+import httpx
+import pytest
+
+from backend.document_parser import ParsedDocument
+from backend.routers import files
+
+
+def upload(client, headers, content=b"%PDF-1.4 test", name="test.pdf"):
+    return client.post(
+        "/files",
+        headers=headers,
+        files={"file": (name, content, "application/pdf")},
+    )
+
+
+def stored_files(upload_dir):
+    return [name for _, _, names in os.walk(upload_dir) for name in names]
+
+
+def test_upload_list_and_download(client, alice, monkeypatch):
+    # Several chunks, the last one partial
+    monkeypatch.setattr(files, "UPLOAD_CHUNK_SIZE", 4)
+    content = b"%PDF-1.4 test"
+
+    response = upload(client, alice, content)
+    assert response.status_code == 201
+    file = response.json()
+    assert file["name"] == "test.pdf"
+    assert file["size"] == len(content)
+    assert stored_files(files.UPLOAD_DIR) == [file["id"].replace("-", "")]
+
+    response = client.get("/files", headers=alice)
+    assert response.status_code == 200
+    assert response.json() == [file]
+
+    response = client.get(f"/files/{file['id']}/download", headers=alice)
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["content-type"] == "application/pdf"
+
+
+def test_other_users_file_not_found(client, alice, bob):
+    file_id = upload(client, alice).json()["id"]
+
+    assert client.get("/files", headers=bob).json() == []
+    for method, path in [
+        ("GET", f"/files/{file_id}/download"),
+        ("POST", f"/files/{file_id}/parse"),
+        ("DELETE", f"/files/{file_id}"),
+    ]:
+        response = client.request(method, path, headers=bob)
+        assert response.status_code == 404, (method, path)
+
+    response = client.get(f"/files/{file_id}/download", headers=alice)
+    assert response.status_code == 200
+
+
+def test_download_cache_headers_and_not_modified(client, alice):
+    file_id = upload(client, alice).json()["id"]
+
+    response = client.get(f"/files/{file_id}/download", headers=alice)
+    etag = response.headers["etag"]
+    assert etag == f'"{file_id.replace("-", "")}"'
+    assert response.headers["cache-control"] == files.DOWNLOAD_CACHE_CONTROL
+
+    for if_none_match in [etag, f"W/{etag}", f'"other", {etag}', "*"]:
+        response = client.get(
+            f"/files/{file_id}/download",
+            headers={**alice, "If-None-Match": if_none_match},
+        )
+        assert response.status_code == 304, if_none_match
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+
+    response = client.get(
+        f"/files/{file_id}/download",
+        headers={**alice, "If-None-Match": '"other"'},
+    )
+    assert response.status_code == 200
+
+
+def test_oversized_upload_rejected_by_content_length(client, alice, monkeypatch):
+    monkeypatch.setattr(files, "MAX_UPLOAD_BYTES", 1024)
+
+    response = upload(client, alice, content=b"x" * 2048)
+    assert response.status_code == 413
+    assert client.get("/files", headers=alice).json() == []
+    assert stored_files(files.UPLOAD_DIR) == []
+
+
+def test_oversized_upload_rejected_while_streaming(client, alice, monkeypatch):
+    monkeypatch.setattr(files, "MAX_UPLOAD_BYTES", 1024)
+
+    # A chunked body has no Content-Length, so the limit is only hit while
+    # the upload is written to disk
+    boundary = "testboundary"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="big.pdf"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + b"x" * 2048 + f"\r\n--{boundary}--\r\n".encode()
+
+    response = client.post(
+        "/files",
+        headers={
+            **alice,
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+        },
+        content=iter([body]),
+    )
+    assert response.status_code == 413
+    assert client.get("/files", headers=alice).json() == []
+    assert stored_files(files.UPLOAD_DIR) == []
+
+
+def serve(response, method="GET", headers=(), extensions=None):
+    """
+    Run an ASGI response directly and return the messages it sent. File
+    handles passed to zerocopysend are read before the response closes them.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": method,
+        "path": "/",
+        "headers": [(k.encode(), v.encode()) for k, v in headers],
+        "extensions": extensions or {},
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            message = {**message, "body": message["file"].read(message["count"])}
+        messages.append(message)
+
+    asyncio.run(response(scope, receive, send))
+    return messages
+
+
+ZEROCOPY = {"http.response.zerocopysend": {}}
+
+
+def test_zerocopy_download(tmp_path):
+    path = tmp_path / "test.pdf"
+    path.write_bytes(b"%PDF-1.4 test")
+
+    for stat_result in [None, os.stat(path)]:
+        response = files.ZeroCopyFileResponse(
+            path, media_type="application/pdf", stat_result=stat_result
+        )
+        start, body = serve(response, extensions=ZEROCOPY)
+
+        assert start["type"] == "http.response.start"
+        assert start["status"] == 200
+        headers = dict(start["headers"])
+        assert headers[b"content-length"] == b"13"
+        assert headers[b"content-type"] == b"application/pdf"
+        assert body["type"] == "http.response.zerocopysend"
+        assert body["body"] == b"%PDF-1.4 test"
+        assert body["more_body"] is False
+        assert body["file"].closed
+
+
+def test_zerocopy_falls_back_to_regular_response(tmp_path):
+    path = tmp_path / "test.pdf"
+    path.write_bytes(b"%PDF-1.4 test")
+
+    for kwargs in [
+        {},
+        {"extensions": ZEROCOPY, "method": "HEAD"},
+        {"extensions": ZEROCOPY, "headers": [("range", "bytes=0-3")]},
+    ]:
+        messages = serve(
+            files.ZeroCopyFileResponse(path, media_type="application/pdf"),
+            **kwargs,
+        )
+        assert messages[0]["type"] == "http.response.start"
+        assert "http.response.zerocopysend" not in [m["type"] for m in messages]
+
+    # The range request is served by FileResponse itself
+    start, *body = messages
+    assert start["status"] == 206
+    assert b"".join(m.get("body", b"") for m in body) == b"%PDF"
+
+
+def test_delete_removes_stored_file(client, alice):
+    file_id = upload(client, alice).json()["id"]
+    assert stored_files(files.UPLOAD_DIR) != []
+
+    assert client.delete(f"/files/{file_id}", headers=alice).status_code == 204
+    assert client.get("/files", headers=alice).json() == []
+    assert stored_files(files.UPLOAD_DIR) == []
+    assert client.delete(f"/files/{file_id}", headers=alice).status_code == 404
+
+
+class FakeParser:
+    """Stands in for parse_pdf, counting calls."""
+
+    def __init__(self, missing_pages=(), delay=0.0):
+        self.missing_pages = list(missing_pages)
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self, pdf_bytes):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return ParsedDocument(chunks=[], missing_pages=self.missing_pages)
+
+
+def test_parse_result_cached(client, alice, monkeypatch):
+    parser = FakeParser()
+    monkeypatch.setattr(files, "parse_pdf", parser)
+    file_id = upload(client, alice).json()["id"]
+
+    for _ in range(2):
+        response = client.post(f"/files/{file_id}/parse", headers=alice)
+        assert response.status_code == 200
+        assert response.json() == {"chunks": []}
+    assert parser.calls == 1
+    assert files._parse_locks == {}
+
+    # Deleting the file drops its cached result
+    client.delete(f"/files/{file_id}", headers=alice)
+    assert files._parse_cache == {}
+
+
+def test_partial_parse_not_cached(client, alice, monkeypatch):
+    parser = FakeParser(missing_pages=[2])
+    monkeypatch.setattr(files, "parse_pdf", parser)
+    file_id = upload(client, alice).json()["id"]
+
+    for _ in range(2):
+        response = client.post(f"/files/{file_id}/parse", headers=alice)
+        assert response.status_code == 200
+    assert parser.calls == 2
+    assert files._parse_locks == {}
+
+
+def test_concurrent_parses_share_one(client, alice, monkeypatch):
+    parser = FakeParser(delay=0.05)
+    monkeypatch.setattr(files, "parse_pdf", parser)
+    file_id = upload(client, alice).json()["id"]
+
+    async def parse_concurrently():
+        transport = httpx.ASGITransport(app=client.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as async_client:
+            return await asyncio.gather(
+                *[
+                    async_client.post(f"/files/{file_id}/parse", headers=alice)
+                    for _ in range(3)
+                ]
+            )
+
+    responses = asyncio.run(parse_concurrently())
+    assert [response.status_code for response in responses] == [200] * 3
+    assert parser.calls == 1
+    assert files._parse_locks == {}
+
+
+def test_parse_lock_kept_while_requests_wait():
+    file_id = uuid.uuid4()
+    active = 0
+    max_active = 0
+
+    async def parse(fail_on=None):
+        nonlocal active, max_active
+        async with files._parse_lock(file_id):
+            active += 1
+            max_active = max(max_active, active)
+            try:
+                if fail_on is not None:
+                    await fail_on.wait()
+                    raise RuntimeError("parse failed")
+                await asyncio.sleep(0.01)
+            finally:
+                active -= 1
+
+    async def scenario():
+        fail = asyncio.Event()
+        later = []
+
+        async def first():
+            # A request arriving just after the first parse failed, while
+            # the second is being handed the lock
+            with pytest.raises(RuntimeError):
+                await parse(fail_on=fail)
+            later.append(asyncio.create_task(parse()))
+
+        first_task = asyncio.create_task(first())
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(parse())
+        await asyncio.sleep(0)
+        assert files._parse_locks[file_id].users == 2
+
+        fail.set()
+        await first_task
+        await asyncio.gather(waiting, *later)
+
+    asyncio.run(scenario())
+    assert max_active == 1
+    assert files._parse_locks == {}
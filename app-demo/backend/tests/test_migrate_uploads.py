@@ -0,0 +1,31 @@
+import os
+import uuid
+
+from backend import migrate_uploads
+from backend.routers import files
+
+
+def test_migrate_uploads(monkeypatch):
+    monkeypatch.setattr(migrate_uploads, "UPLOAD_DIR", files.UPLOAD_DIR)
+    os.makedirs(files.UPLOAD_DIR)
+
+    file_ids = [uuid.uuid4() for _ in range(3)]
+    for file_id in file_ids:
+        with open(os.path.join(files.UPLOAD_DIR, str(file_id)), "wb") as f:
+            f.write(file_id.bytes)
+    # Not uploads, and left alone
+    with open(os.path.join(files.UPLOAD_DIR, "notes.txt"), "wb") as f:
+        f.write(b"notes")
+    os.makedirs(os.path.join(files.UPLOAD_DIR, "ab"))
+
+    assert migrate_uploads.migrate_uploads() == 3
+
+    for file_id in file_ids:
+        with open(files.get_upload_path(file_id), "rb") as f:
+            assert f.read() == file_id.bytes
+    assert sorted(os.listdir(files.UPLOAD_DIR)) == sorted(
+        {"notes.txt", "ab"} | {file_id.hex[-2:] for file_id in file_ids}
+    )
+
+    # Running it again finds nothing to move
+    assert migrate_uploads.migrate_uploads() == 0